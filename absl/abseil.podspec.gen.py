@@ -2,17 +2,25 @@
 # -*- coding: utf-8 -*-
 """This script generates abseil.podspec from all BUILD.bazel files.
 
-This is expected to run on abseil git repository with Bazel 1.0 on Linux.
-It recursively analyzes BUILD.bazel files using query command of Bazel to
-dump its build rules in XML format. From these rules, it constructs podspec
-structure.
+This is expected to run on abseil git repository on Linux.
+It recursively finds BUILD.bazel files and parses their cc rules directly
+without running Bazel. When --bazel is given, it uses query command of
+Bazel 1.0 to dump the build rules in XML format instead, and the collected
+rules are cached in .podspec_rules_cache until any of BUILD.bazel files
+changes. From these rules, it constructs podspec structure.
 """
 
 import argparse
+import ast
 import collections
+import functools
+import hashlib
+import io
 import os
+import pickle
 import re
 import subprocess
+import tempfile
 import xml.etree.ElementTree
 
 # Template of root podspec.
@@ -46,65 +54,212 @@ Pod::Spec.new do |s|
   s.watchos.deployment_target = '2.0'
 """
 
+# Directory where rules collected from bazel are cached.
+CACHE_DIR = ".podspec_rules_cache"
+
 # Rule object representing the rule of Bazel BUILD.
 Rule = collections.namedtuple(
     "Rule", "type name package srcs hdrs textual_hdrs deps visibility testonly")
 
 
-def get_elem_value(elem, name):
+def get_elem_value(children, name):
   """Returns the value of XML element with the given name."""
-  for child in elem:
-    if child.attrib.get("name") != name:
-      continue
-    if child.tag == "string":
-      return child.attrib.get("value")
-    if child.tag == "boolean":
-      return child.attrib.get("value") == "true"
-    if child.tag == "list":
-      return [nested_child.attrib.get("value") for nested_child in child]
-    raise "Cannot recognize tag: " + child.tag
-  return None
+  child = children.get(name)
+  if child is None:
+    return None
+  if child.tag == "string":
+    return child.attrib.get("value")
+  if child.tag == "boolean":
+    return child.attrib.get("value") == "true"
+  if child.tag == "list":
+    return [nested_child.attrib.get("value") for nested_child in child]
+  raise ValueError("Cannot recognize tag: " + child.tag)
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_path(path):
+  """Returns the normalized path."""
+  # e.g. "//absl/strings:dir/header.h" -> "absl/strings/dir/header.h"
+  return path.lstrip("/").replace(":", "/")
 
 
 def normalize_paths(paths):
   """Returns the list of normalized path."""
-  # e.g. ["//absl/strings:dir/header.h"] -> ["absl/strings/dir/header.h"]
-  return [path.lstrip("/").replace(":", "/") for path in paths]
+  return [normalize_path(path) for path in paths]
 
 
-def parse_rule(elem, package):
+def parse_rule(elem):
   """Returns a rule from bazel XML rule."""
+  # e.g. "//absl/strings:strings" -> "//absl/strings"
+  package = elem.attrib["name"].rpartition(":")[0]
+  # Indexes children by name once rather than scanning them per attribute.
+  children = {child.attrib.get("name"): child for child in elem}
   return Rule(
       type=elem.attrib["class"],
-      name=get_elem_value(elem, "name"),
+      name=get_elem_value(children, "name"),
       package=package,
-      srcs=normalize_paths(get_elem_value(elem, "srcs") or []),
-      hdrs=normalize_paths(get_elem_value(elem, "hdrs") or []),
-      textual_hdrs=normalize_paths(get_elem_value(elem, "textual_hdrs") or []),
-      deps=get_elem_value(elem, "deps") or [],
-      visibility=get_elem_value(elem, "visibility") or [],
-      testonly=get_elem_value(elem, "testonly") or False)
-
-
-def read_build(package):
-  """Runs bazel query on given package file and returns all cc rules."""
-  result = subprocess.check_output(
-      ["bazel", "query", package + ":all", "--output", "xml"])
-  root = xml.etree.ElementTree.fromstring(result)
+      srcs=normalize_paths(get_elem_value(children, "srcs") or []),
+      hdrs=normalize_paths(get_elem_value(children, "hdrs") or []),
+      textual_hdrs=normalize_paths(
+          get_elem_value(children, "textual_hdrs") or []),
+      deps=get_elem_value(children, "deps") or [],
+      visibility=get_elem_value(children, "visibility") or [],
+      testonly=get_elem_value(children, "testonly") or False)
+
+
+def evaluate_starlark(node):
+  """Returns the value of Starlark expression consisting of literals."""
+  if isinstance(node, ast.Constant):
+    return node.value
+  if isinstance(node, ast.List):
+    return [evaluate_starlark(elt) for elt in node.elts]
+  if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+    return evaluate_starlark(node.left) + evaluate_starlark(node.right)
+  if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+      node.func.id == "select"):
+    # Takes values of all conditions like bazel query does.
+    values = []
+    for value in node.args[0].values:
+      values.extend(evaluate_starlark(value))
+    return values
+  raise ValueError("Cannot evaluate expression at line {}: {}".format(
+      node.lineno, ast.dump(node)))
+
+
+def get_keyword_value(call, name):
+  """Returns the value of keyword argument of Starlark call with given name."""
+  for keyword in call.keywords:
+    if keyword.arg == name:
+      return evaluate_starlark(keyword.value)
+  return None
+
+
+def resolve_labels(labels, package):
+  """Returns the list of absolute labels resolved in given package."""
+  # e.g. "//absl/base" -> "//absl/base:base", ":config" -> "//absl/base:config"
+  resolved = []
+  for label in labels:
+    if label.startswith(":"):
+      label = package + label
+    elif not label.startswith(("//", "@")):
+      label = package + ":" + label
+    else:
+      path = label.partition("//")[2]
+      if path and ":" not in path:
+        label += ":" + path.rpartition("/")[2]
+    resolved.append(label)
+  return resolved
+
+
+def parse_build_rule(call, package):
+  """Returns a rule from Starlark call of BUILD.bazel."""
+  return Rule(
+      type=call.func.id,
+      name=get_keyword_value(call, "name"),
+      package=package,
+      srcs=normalize_paths(
+          resolve_labels(get_keyword_value(call, "srcs") or [], package)),
+      hdrs=normalize_paths(
+          resolve_labels(get_keyword_value(call, "hdrs") or [], package)),
+      textual_hdrs=normalize_paths(
+          resolve_labels(
+              get_keyword_value(call, "textual_hdrs") or [], package)),
+      deps=resolve_labels(get_keyword_value(call, "deps") or [], package),
+      visibility=resolve_labels(
+          get_keyword_value(call, "visibility") or [], package),
+      testonly=bool(get_keyword_value(call, "testonly")))
+
+
+def read_build(build_dir):
+  """Parses BUILD.bazel in given directory and returns all cc rules."""
+  package = "//" + build_dir
+  build_path = os.path.join(build_dir, "BUILD.bazel")
+  with open(build_path) as f:
+    module = ast.parse(f.read(), build_path)
+  # Starlark is syntactically a subset of Python, so BUILD.bazel can be parsed
+  # as Python and rules are top-level calls such as cc_library(...).
   return [
-      parse_rule(elem, package)
-      for elem in root
-      if elem.tag == "rule" and elem.attrib["class"].startswith("cc_")
+      parse_build_rule(stmt.value, package)
+      for stmt in module.body
+      if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call) and
+      isinstance(stmt.value.func, ast.Name) and
+      stmt.value.func.id.startswith("cc_")
   ]
 
 
-def collect_rules(root_path):
+def iter_build_dirs(root_path):
+  """Yields all directories containing BUILD.bazel under root path."""
+  has_build = False
+  sub_dirs = []
+  with os.scandir(root_path) as entries:
+    for entry in entries:
+      if entry.is_dir(follow_symlinks=False):
+        sub_dirs.append(entry.path)
+      elif entry.name == "BUILD.bazel":
+        has_build = True
+  if has_build:
+    yield root_path
+  for sub_dir in sorted(sub_dirs):
+    yield from iter_build_dirs(sub_dir)
+
+
+def query_rules(build_dirs):
+  """Runs bazel query on given directories and yields all cc rules."""
+  # Queries all packages at once, which is much faster than running one bazel
+  # query per package.
+  query = " + ".join("//" + build_dir + ":all" for build_dir in build_dirs)
+  result = subprocess.check_output(["bazel", "query", query, "--output", "xml"])
+  # Parses the result incrementally and drops each rule once it's consumed
+  # so that the whole XML tree is never held in memory.
+  events = xml.etree.ElementTree.iterparse(
+      io.BytesIO(result), events=("start", "end"))
+  _, root = next(events)
+  for event, elem in events:
+    if event != "end" or elem.tag != "rule":
+      continue
+    if elem.attrib["class"].startswith("cc_"):
+      yield parse_rule(elem)
+    root.clear()
+
+
+def collect_rules(root_path, use_bazel):
   """Collects and returns all rules from root path recursively."""
-  rules = []
-  for cur, _, _ in os.walk(root_path):
-    build_path = os.path.join(cur, "BUILD.bazel")
-    if os.path.exists(build_path):
-      rules.extend(read_build("//" + cur))
+  build_dirs = list(iter_build_dirs(root_path))
+  if not use_bazel:
+    return [rule for build_dir in build_dirs for rule in read_build(build_dir)]
+  # Rules are cached on disk by the hash of all BUILD.bazel files (and of this
+  # script) so that bazel is not queried again if nothing has changed.
+  digest = hashlib.sha1()
+  for path in [__file__] + [
+      os.path.join(build_dir, "BUILD.bazel") for build_dir in build_dirs
+  ]:
+    digest.update(path.encode("utf-8"))
+    with open(path, "rb") as f:
+      digest.update(f.read())
+  cache_name = digest.hexdigest() + ".pkl"
+  cache_path = os.path.join(CACHE_DIR, cache_name)
+  try:
+    with open(cache_path, "rb") as f:
+      return pickle.load(f)
+  except (OSError, EOFError, pickle.UnpicklingError):
+    # A missing or unreadable cache is treated as a cache miss.
+    pass
+  rules = list(query_rules(build_dirs))
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  # Writes to a temporary file first so that an interrupted run never leaves
+  # a truncated cache behind.
+  fd, temp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+  try:
+    with os.fdopen(fd, "wb") as f:
+      pickle.dump(rules, f)
+    os.replace(temp_path, cache_path)
+  except BaseException:
+    os.remove(temp_path)
+    raise
+  # Removes caches of older BUILD.bazel files.
+  for name in os.listdir(CACHE_DIR):
+    if name.endswith(".pkl") and name != cache_name:
+      os.remove(os.path.join(CACHE_DIR, name))
   return rules
 
 
@@ -124,6 +279,7 @@ def get_spec_var(depth):
   return "s" if depth == 0 else "s{}".format(depth)
 
 
+@functools.lru_cache(maxsize=None)
 def get_spec_name(label):
   """Converts the label of bazel rule to the name of podspec."""
   assert label.startswith("//absl/"), "{} doesn't start with //absl/".format(
@@ -134,73 +290,90 @@ def get_spec_name(label):
 
 def write_podspec(f, rules, args):
   """Writes a podspec from given rules and args."""
-  rule_dir = build_rule_directory(rules)["abseil"]
+  rule_dir = dict(build_rule_directory(rules))["abseil"]
+  # Buffers the whole podspec and encodes and writes it at once.
+  out = []
   # Write root part with given arguments
   spec = re.sub(r"\$\{(\w+)\}", lambda x: args[x.group(1)],
                 SPEC_TEMPLATE).lstrip()
-  f.write(spec)
+  out.append(spec)
   # Write all target rules
-  write_podspec_map(f, rule_dir, 0)
-  f.write("end\n")
+  write_podspec_map(out, rule_dir)
+  out.append("end\n")
+  f.write("".join(out).encode("utf-8"))
 
 
 def build_rule_directory(rules):
-  """Builds a tree-style rule directory from given rules."""
-  rule_dir = {}
+  """Builds a tree-style rule directory from given rules.
+
+  Each level of the directory is a list of (key, value) pairs sorted by key
+  where value is either a rule or a nested level.
+  """
+  tree = lambda: collections.defaultdict(tree)
+  rule_dir = tree()
   for rule in rules:
     cur = rule_dir
     for frag in get_spec_name(rule.package).split("/"):
-      cur = cur.setdefault(frag, {})
+      cur = cur[frag]
     cur[rule.name] = rule
-  return rule_dir
-
-
-def write_podspec_map(f, cur_map, depth):
-  """Writes podspec from rule map recursively."""
-  for key, value in sorted(cur_map.items()):
-    indent = "  " * (depth + 1)
-    f.write("{indent}{var0}.subspec '{key}' do |{var1}|\n".format(
-        indent=indent,
-        key=key,
-        var0=get_spec_var(depth),
-        var1=get_spec_var(depth + 1)))
-    if isinstance(value, dict):
-      write_podspec_map(f, value, depth + 1)
-    else:
-      write_podspec_rule(f, value, depth + 1)
-    f.write("{indent}end\n".format(indent=indent))
-
-
-def write_podspec_rule(f, rule, depth):
-  """Writes podspec from given rule."""
-  indent = "  " * (depth + 1)
-  spec_var = get_spec_var(depth)
-  # Puts all files in hdrs, textual_hdrs, and srcs into source_files.
-  # Since CocoaPods treats header_files a bit differently from bazel,
-  # this won't generate a header_files field so that all source_files
-  # are considered as header files.
-  srcs = sorted(set(rule.hdrs + rule.textual_hdrs + rule.srcs))
-  write_indented_list(
-      f, "{indent}{var}.source_files = ".format(indent=indent, var=spec_var),
-      srcs)
-  # Writes dependencies of this rule.
-  for dep in sorted(rule.deps):
-    name = get_spec_name(dep.replace(":", "/"))
-    f.write("{indent}{var}.dependency '{dep}'\n".format(
-        indent=indent, var=spec_var, dep=name))
-
-
-def write_indented_list(f, leading, values):
+  return sort_rule_directory(rule_dir)
+
+
+def sort_rule_directory(cur_map):
+  """Converts a rule map into a list of (key, value) pairs sorted by key."""
+  return sorted((key, sort_rule_directory(value) if isinstance(value, dict)
+                 else value) for key, value in cur_map.items())
+
+
+def write_podspec_map(out, rule_dir):
+  """Writes podspec from rule directory."""
+  # Walks the directory with an explicit stack instead of recursion. An entry
+  # without value marks the end of the subspec with the given key.
+  stack = [(0, key, value) for key, value in reversed(rule_dir)]
+  # Indent strings for each depth, extended as deeper subspecs are reached.
+  indents = [""]
+  while stack:
+    depth, key, value = stack.pop()
+    while len(indents) < depth + 3:
+      indents.append("  " * len(indents))
+    indent = indents[depth + 1]
+    if value is None:
+      out.append(f"{indent}end\n")
+      continue
+    spec_var = get_spec_var(depth + 1)
+    out.append(
+        f"{indent}{get_spec_var(depth)}.subspec '{key}' do |{spec_var}|\n")
+    stack.append((depth, key, None))
+    if isinstance(value, list):
+      stack.extend(
+          (depth + 1, sub_key, sub_value)
+          for sub_key, sub_value in reversed(value))
+      continue
+    # Writes the rule.
+    indent = indents[depth + 2]
+    # Puts all files in hdrs, textual_hdrs, and srcs into source_files.
+    # Since CocoaPods treats header_files a bit differently from bazel,
+    # this won't generate a header_files field so that all source_files
+    # are considered as header files.
+    srcs = sorted(set(value.hdrs + value.textual_hdrs + value.srcs))
+    write_indented_list(out, f"{indent}{spec_var}.source_files = ", srcs)
+    # Writes dependencies of this rule.
+    for dep in sorted(value.deps):
+      name = get_spec_name(dep.replace(":", "/"))
+      out.append(f"{indent}{spec_var}.dependency '{name}'\n")
+
+
+def write_indented_list(out, leading, values):
   """Writes leading values in an indented style."""
-  f.write(leading)
-  f.write((",\n" + " " * len(leading)).join("'{}'".format(v) for v in values))
-  f.write("\n")
+  out.append(leading)
+  out.append((",\n" + " " * len(leading)).join(f"'{v}'" for v in values))
+  out.append("\n")
 
 
 def generate(args):
   """Generates a podspec file from all BUILD files under absl directory."""
-  rules = filter(relevant_rule, collect_rules("absl"))
-  with open(args.output, "wt") as f:
+  rules = filter(relevant_rule, collect_rules("absl", args.bazel))
+  with open(args.output, "wb") as f:
     write_podspec(f, rules, vars(args))
 
 
@@ -219,6 +392,10 @@ def main():
       "--output",
       default="abseil.podspec",
       help="The name of output file (default: abseil.podspec)")
+  parser.add_argument(
+      "--bazel",
+      action="store_true",
+      help="Collects rules using bazel query instead of parsing BUILD.bazel")
   args = parser.parse_args()
   if args.tag is None:
     args.tag = args.version
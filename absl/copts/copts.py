@@ -9,14 +9,18 @@ compilation options:
 
 The generated copts are consumed by configure_copts.bzl and
 AbseilConfigureCopts.cmake.
+
+Flag lists shared between several copts are also exposed as frozensets
+(with a _SET suffix) for fast membership checks.
 """
 
 # /Wall with msvc includes unhelpful warnings such as C4711, C4710, ...
-MSVC_BIG_WARNING_FLAGS = [
+MSVC_BIG_WARNING_FLAGS = (
     "/W3",
-]
+)
+MSVC_BIG_WARNING_FLAGS_SET = frozenset(MSVC_BIG_WARNING_FLAGS)
 
-LLVM_TEST_DISABLE_WARNINGS_FLAGS = [
+LLVM_TEST_DISABLE_WARNINGS_FLAGS = (
     "-Wno-c99-extensions",
     "-Wno-deprecated-declarations",
     "-Wno-missing-noreturn",
@@ -35,9 +39,11 @@ LLVM_TEST_DISABLE_WARNINGS_FLAGS = [
     "-Wno-zero-as-null-pointer-constant",
     # gtest depends on this GNU extension being offered.
     "-Wno-gnu-zero-variadic-macro-arguments",
-]
+)
+LLVM_TEST_DISABLE_WARNINGS_FLAGS_SET = frozenset(
+    LLVM_TEST_DISABLE_WARNINGS_FLAGS)
 
-MSVC_DEFINES = [
+MSVC_DEFINES = (
     "/DNOMINMAX",  # Don't define min and max macros (windows.h)
     # Don't bloat namespace with incompatible winsock versions.
     "/DWIN32_LEAN_AND_MEAN",
@@ -46,10 +52,11 @@ MSVC_DEFINES = [
     "/D_SCL_SECURE_NO_WARNINGS",
     # Introduced in VS 2017 15.8, allow overaligned types in aligned_storage
     "/D_ENABLE_EXTENDED_ALIGNED_STORAGE",
-]
+)
+MSVC_DEFINES_SET = frozenset(MSVC_DEFINES)
 
 COPT_VARS = {
-    "ABSL_GCC_FLAGS": [
+    "ABSL_GCC_FLAGS": (
         "-Wall",
         "-Wextra",
         "-Wcast-qual",
@@ -66,8 +73,8 @@ COPT_VARS = {
         "-Wwrite-strings",
         # Don't define min and max macros (Build on Windows using gcc)
         "-DNOMINMAX",
-    ],
-    "ABSL_GCC_TEST_FLAGS": [
+    ),
+    "ABSL_GCC_TEST_FLAGS": (
         "-Wno-conversion-null",
         "-Wno-deprecated-declarations",
         "-Wno-missing-declarations",
@@ -75,8 +82,8 @@ COPT_VARS = {
         "-Wno-unused-function",
         "-Wno-unused-parameter",
         "-Wno-unused-private-field",
-    ],
-    "ABSL_LLVM_FLAGS": [
+    ),
+    "ABSL_LLVM_FLAGS": (
         "-Wall",
         "-Wextra",
         "-Wcast-qual",
@@ -114,15 +121,17 @@ COPT_VARS = {
         "-Wno-sign-conversion",
         # Don't define min and max macros (Build on Windows using clang)
         "-DNOMINMAX",
-    ],
+    ),
     "ABSL_LLVM_TEST_FLAGS":
         LLVM_TEST_DISABLE_WARNINGS_FLAGS,
     "ABSL_CLANG_CL_FLAGS":
-        (MSVC_BIG_WARNING_FLAGS + MSVC_DEFINES),
+        tuple(dict.fromkeys((*MSVC_BIG_WARNING_FLAGS, *MSVC_DEFINES))),
     "ABSL_CLANG_CL_TEST_FLAGS":
         LLVM_TEST_DISABLE_WARNINGS_FLAGS,
     "ABSL_MSVC_FLAGS":
-        MSVC_BIG_WARNING_FLAGS + MSVC_DEFINES + [
+        tuple(dict.fromkeys((
+            *MSVC_BIG_WARNING_FLAGS,
+            *MSVC_DEFINES,
             # Increase the number of sections available in object files
             "/bigobj",
             "/wd4005",  # macro-redefinition
@@ -137,27 +146,27 @@ COPT_VARS = {
             "/wd4503",
             # forcing value to bool 'true' or 'false' (performance warning)
             "/wd4800",
-        ],
-    "ABSL_MSVC_TEST_FLAGS": [
+        ))),
+    "ABSL_MSVC_TEST_FLAGS": (
         "/wd4018",  # signed/unsigned mismatch
         "/wd4101",  # unreferenced local variable
         "/wd4503",  # decorated name length exceeded, name was truncated
         "/wd4996",  # use of deprecated symbol
         "/DNOMINMAX",  # disable the min() and max() macros from <windows.h>
-    ],
-    "ABSL_MSVC_LINKOPTS": [
+    ),
+    "ABSL_MSVC_LINKOPTS": (
         # Object file doesn't export any previously undefined symbols
         "-ignore:4221",
-    ],
+    ),
     # "HWAES" is an abbreviation for "hardware AES" (AES - Advanced Encryption
     # Standard). These flags are used for detecting whether or not the target
     # architecture has hardware support for AES instructions which can be used
     # to improve performance of some random bit generators.
-    "ABSL_RANDOM_HWAES_ARM64_FLAGS": ["-march=armv8-a+crypto"],
-    "ABSL_RANDOM_HWAES_ARM32_FLAGS": ["-mfpu=neon"],
-    "ABSL_RANDOM_HWAES_X64_FLAGS": [
+    "ABSL_RANDOM_HWAES_ARM64_FLAGS": ("-march=armv8-a+crypto",),
+    "ABSL_RANDOM_HWAES_ARM32_FLAGS": ("-mfpu=neon",),
+    "ABSL_RANDOM_HWAES_X64_FLAGS": (
         "-maes",
         "-msse4.1",
-    ],
-    "ABSL_RANDOM_HWAES_MSVC_X64_FLAGS": [],
+    ),
+    "ABSL_RANDOM_HWAES_MSVC_X64_FLAGS": (),
 }
@@ -6,7 +6,7 @@
 # members to help us debug any problems that arise.
 
 from conans import ConanFile, CMake, tools
-from conans.errors import ConanInvalidConfiguration
+from conans.errors import ConanException, ConanInvalidConfiguration
 from conans.model.version import Version
 
 
@@ -29,11 +29,29 @@ class AbseilConan(ConanFile):
            Version(self.settings.compiler.version.value) < "14":
             raise ConanInvalidConfiguration("Abseil does not support MSVC < 14")
 
-    def build(self):
-        tools.replace_in_file("CMakeLists.txt", "project(absl CXX)", "project(absl CXX)\ninclude(conanbuildinfo.cmake)\nconan_basic_setup()")
+    def _configure_cmake(self):
         cmake = CMake(self)
         cmake.definitions["BUILD_TESTING"] = False
         cmake.configure()
+        return cmake
+
+    def _inject_conan_setup(self):
+        # Leaves CMakeLists.txt untouched if it has been patched already so
+        # that rebuilds of a cached source tree don't invalidate CMake.
+        with open("CMakeLists.txt") as f:
+            txt = f.read()
+        if "conan_basic_setup()" in txt:
+            return
+        project = "project(absl LANGUAGES CXX)"
+        if project not in txt:
+            raise ConanException("Cannot find '{}' in CMakeLists.txt".format(project))
+        txt = txt.replace(project, project + "\ninclude(conanbuildinfo.cmake)\nconan_basic_setup()", 1)
+        with open("CMakeLists.txt", "w") as f:
+            f.write(txt)
+
+    def build(self):
+        self._inject_conan_setup()
+        cmake = self._configure_cmake()
         cmake.build()
 
     def package(self):